@@ -0,0 +1,162 @@
+import logging
+import os
+import uuid
+
+from aiohttp import web
+import jinja2
+
+import db
+import mailer
+import pages
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _url_for_static(endpoint: str, filename: str) -> str:
+    # The templates only ever use url_for for static files.
+    assert endpoint == "static"
+    return f"/static/{filename}"
+
+
+def _parse_ids(request: web.Request):
+    """Return (user_id, secondary_id) from the URL, or 404."""
+    try:
+        return (int(request.match_info["user_id"]),
+                uuid.UUID(request.match_info["secondary_id"]))
+    except ValueError:
+        raise web.HTTPNotFound()
+
+
+async def form_field(request: web.Request, name: str) -> str:
+    """Return a field from the posted form, or 400 like Flask does."""
+    form = await request.post()
+    value = form.get(name)
+    if not isinstance(value, str):
+        raise web.HTTPBadRequest()
+    return value
+
+
+def create_app(
+    session_manager: db.AsyncSessionManager,
+    allowed_domain: str,
+    mail: mailer.AsyncMailer = mailer.AsyncMailer(mailer.PrintMailer()),
+) -> web.Application:
+    """Create an asyncio version of server.create_app with the same routes."""
+    app = web.Application()
+    logger = logging.getLogger("async_server")
+    sm = session_manager
+    templates = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(os.path.join(ROOT, "templates")),
+        autoescape=True,
+    )
+    templates.globals["url_for"] = _url_for_static
+
+    logger.info("Using %s for mail" % mail)
+
+    def url(name: str, **parts) -> str:
+        parts = {k: str(v) for k, v in parts.items()}
+        return str(app.router[name].url_for(**parts))
+
+    def render(template: str, status: int = 200, **context) -> web.Response:
+        return web.Response(
+            text=templates.get_template(template).render(**context),
+            status=status,
+            content_type="text/html",
+        )
+
+    def cached(response: web.Response) -> web.Response:
+        response.headers["Cache-Control"] = "public, max-age=2592000, immutable"
+        return response
+
+    def redirect_to_page(page: pages.Page, user_id: int,
+                         secondary_id: uuid.UUID) -> web.HTTPSeeOther:
+        """Return a 303 redirect to a page of the verification flow."""
+        if page is pages.Page.START:
+            return web.HTTPSeeOther(
+                url("start", user_id=user_id, secondary_id=secondary_id))
+        if page is pages.Page.VERIFY:
+            return web.HTTPSeeOther(
+                url("verify", user_id=user_id, secondary_id=secondary_id))
+        if page is pages.Page.SUCCESS:
+            return web.HTTPSeeOther(url("success"))
+        return web.HTTPSeeOther(url("failure"))
+
+    async def start(request: web.Request) -> web.Response:
+        user_id, secondary_id = _parse_ids(request)
+        session = await sm.session(user_id, secondary_id)
+        if session is None:
+            raise web.HTTPNotFound()
+
+        # Handle other states that shouldn't go to /start.
+        page = pages.for_start(session)
+        if page is not pages.Page.START:
+            raise redirect_to_page(page, user_id, secondary_id)
+
+        if request.method == "POST":
+            email_addr = await form_field(request, "email")
+            if not email_addr.endswith(allowed_domain):
+                # TODO: error feedback
+                raise redirect_to_page(pages.Page.START, user_id,
+                                       secondary_id)
+
+            logger.info(
+                f"User {session.discord_name} with id {session.user_id} sent an email"
+            )
+            await mail.send(email_addr, session.verification_code,
+                            session.discord_name)
+            await sm.set_email_sent(user_id, secondary_id)
+            raise redirect_to_page(pages.Page.VERIFY, user_id, secondary_id)
+        else:
+            return render("start.html")
+
+    async def verify_post(request: web.Request) -> web.Response:
+        user_id, secondary_id = _parse_ids(request)
+        # Post-Redirect-Get pattern
+        attempted_code = await form_field(request, "verification")
+        verification_result = await sm.verify(user_id, secondary_id,
+                                              attempted_code)
+        raise redirect_to_page(pages.after_verify(verification_result),
+                               user_id, secondary_id)
+
+    async def verify_get(request: web.Request) -> web.Response:
+        user_id, secondary_id = _parse_ids(request)
+        session = await sm.session(user_id, secondary_id)
+        if session is None:
+            raise web.HTTPNotFound()
+
+        # Handle other states that shouldn't go to /verify
+        page = pages.for_verify(session)
+        if page is not pages.Page.VERIFY:
+            raise redirect_to_page(page, user_id, secondary_id)
+
+        return render("verify.html",
+                      remaining_attempts=session.remaining_attempts)
+
+    async def success(request: web.Request) -> web.Response:
+        return cached(render("passed_verification.html"))
+
+    async def failure(request: web.Request) -> web.Response:
+        return cached(render("failed_verification.html"))
+
+    async def root(request: web.Request) -> web.Response:
+        return cached(render("index.html"))
+
+    @web.middleware
+    async def page_not_found(request: web.Request, handler):
+        try:
+            return await handler(request)
+        except web.HTTPNotFound:
+            return render("404.html", status=404)
+
+    session_path = "/{user_id:\\d+}/{secondary_id}"
+    app.middlewares.append(page_not_found)
+    app.router.add_get("/start" + session_path, start, name="start")
+    app.router.add_post("/start" + session_path, start)
+    app.router.add_post("/verify" + session_path, verify_post)
+    app.router.add_get("/verify" + session_path, verify_get, name="verify")
+    app.router.add_get("/success", success, name="success")
+    app.router.add_get("/failure", failure, name="failure")
+    app.router.add_get("/", root, name="root")
+    app.router.add_static("/static", os.path.join(ROOT, "static"))
+
+    return app
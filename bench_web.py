@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Load test for the web server entry points (run_web.py, run_async_web.py).
+
+Holds open a number of slow clients, which trickle in their request headers
+one byte at a time and never finish, while a number of fast clients make
+complete requests back to back. Reports the fast clients' throughput and
+latency, i.e. how well the server keeps serving while it is tied up with
+slow connections.
+
+By default it requests the page for the fake testing session, which it
+creates in the configured database first.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+from urllib.parse import urlsplit
+
+from config import settings
+import db
+
+
+async def slow_client(host: str, port: int, path: str, stop: asyncio.Event):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        return
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+    try:
+        for char in request:
+            writer.write(char.encode())
+            await writer.drain()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1)
+                break
+            except asyncio.TimeoutError:
+                pass
+        await stop.wait()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+async def fast_client(host: str, port: int, path: str, deadline: float,
+                      latencies: List[float], errors: List[int]):
+    request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+               "Connection: close\r\n\r\n").encode()
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            await writer.drain()
+            status = await reader.readline()
+            await reader.read()
+            writer.close()
+        except OSError:
+            errors.append(1)
+            continue
+        if b" 200 " not in status:
+            errors.append(1)
+            continue
+        latencies.append(time.monotonic() - started)
+
+
+async def run(url: str, path: str, slow: int, fast: int, duration: float):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+
+    stop = asyncio.Event()
+    slow_tasks = [
+        asyncio.ensure_future(slow_client(host, port, path, stop))
+        for _ in range(slow)
+    ]
+    # Let the slow clients connect before measuring.
+    await asyncio.sleep(min(5, 1 + slow / 1000))
+
+    latencies: List[float] = []
+    errors: List[int] = []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(fast_client(host, port, path, deadline, latencies,
+                                       errors) for _ in range(fast)))
+    stop.set()
+    await asyncio.gather(*slow_tasks)
+
+    print(f"{url}{path} with {slow} slow and {fast} fast clients:")
+    print(f"  {len(latencies) / duration:.0f} req/s, {len(errors)} errors")
+    if latencies:
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f"  latency p50 {statistics.median(latencies) * 1000:.1f}ms, "
+              f"p99 {p99 * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("url", help="base URL of the server, e.g. http://localhost:5000")
+    parser.add_argument("--path", help="path to request (default: the fake session's /start page)")
+    parser.add_argument("--slow", type=int, default=1000)
+    parser.add_argument("--fast", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        sm = db.SessionManager(settings.common.expiry_s,
+                               settings.common.database_file)
+        path = f"/start/0/{sm._new_fake()}"
+
+    asyncio.run(run(args.url, path, args.slow, args.fast, args.duration))
@@ -3,6 +3,7 @@ import logging
 import sys
 import time
 import uuid
+from typing import Dict, List, Optional, Tuple
 
 import discord
 from discord.ext import commands
@@ -11,23 +12,39 @@ from sqlitedict import SqliteDict
 from config import settings
 import db
 
+# Re-grant jobs checkpoint after every chunk of this many users.
+REGRANT_CHUNK_SIZE = 100
+# Minimum number of seconds between progress reports for a re-grant job.
+REGRANT_REPORT_INTERVAL_S = 30
+
+# Discord JSON error codes
+UNKNOWN_MEMBER = 10007
+UNKNOWN_ROLE = 10011
+UNKNOWN_USER = 10013
+
 
 class VerifyCog(commands.Cog):
     def __init__(
         self,
         bot: discord.Client,
         sm: db.SessionManager,
+        store: db.VerificationStore,
         check_interval: int,
         url: str,
         role_name: str,
+        regrant_concurrency: int,
         *args,
         **kwargs,
     ):
         self.bot = bot
         self.sm = sm
+        self.store = store
         self.check_interval = check_interval
         self.url = url
         self.role_name = role_name
+        self.regrant_concurrency = regrant_concurrency
+        self.regrant_tasks: Dict[int, asyncio.Task] = {}
+        self.backfilled = False
 
         self.logger = logging.getLogger("AndrewBot")
 
@@ -48,8 +65,52 @@ class VerifyCog(commands.Cog):
             else:
                 self.logger.warning(
                     f"{self.role_name} role not found in guild {guild}")
+
+        if not self.backfilled:
+            self.backfilled = True
+            self.bot.loop.create_task(self.backfill_verifications())
+
+        for job in self.store.unfinished_jobs():
+            self.logger.info(f"Resuming role re-grant in {job.guild_id}")
+            self.start_regrant(job)
         self.logger.info("Bot is ready")
 
+    async def backfill_verifications(self):
+        """
+        Record verifications from before they were being recorded: sessions
+        that are completed but not yet expired, and members who already have
+        the verified role (this needs the members intent).
+        """
+        try:
+            by_guild: Dict[int, List[Tuple[int, str]]] = {}
+            async for session in self.sm.completed_sessions():
+                by_guild.setdefault(session.guild_id, []).append(
+                    (session.user_id, session.discord_name))
+            for guild_id, users in by_guild.items():
+                added = self.store.backfill(guild_id, users)
+                self.logger.info(
+                    f"Recorded {added} verifications from sessions in {guild_id}"
+                )
+
+            if not self.bot.intents.members:
+                self.logger.warning(
+                    "Members intent is off, so existing role holders can't be recorded"
+                )
+                return
+            for guild in self.bot.guilds:
+                role_id = self.verified_roles.get(guild.id, None)
+                if role_id is None:
+                    continue
+                users = [(member.id, str(member))
+                         async for member in guild.fetch_members(limit=None)
+                         if role_id in (role.id for role in member.roles)]
+                added = self.store.backfill(guild.id, users)
+                self.logger.info(
+                    f"Recorded {added} verifications from role holders in {guild}"
+                )
+        except Exception:
+            self.logger.exception("Failed to backfill verifications")
+
     async def maintenance_loop(self):
         interval = self.check_interval
         self.logger.info(
@@ -73,6 +134,7 @@ class VerifyCog(commands.Cog):
                         f"Adding role to ({session.discord_name}, {member.id})"
                     )
                     await member.add_roles(role, reason="Verification Bot")
+                    self.store.record(user_id, guild_id, session.discord_name)
                     self.sm.complete_session(user_id, session.uuid)
                 except Exception:
                     self.logger.exception(
@@ -82,6 +144,144 @@ class VerifyCog(commands.Cog):
             await self.sm.collect_garbage()
             await asyncio.sleep(interval)
 
+    def start_regrant(self, job: db.RegrantJob):
+        task = self.regrant_tasks.get(job.guild_id)
+        if task is not None and not task.done():
+            return
+        self.regrant_tasks[job.guild_id] = self.bot.loop.create_task(
+            self.regrant_loop(job))
+
+    async def regrant_loop(self, job: db.RegrantJob):
+        """
+        Give the verified role to everyone in a re-grant job, without sending
+        any email.
+
+        Users are paged through in user_id order and progress is checkpointed
+        after every page, so after a restart at most one page gets redone
+        (adding a role twice is harmless). discord.py takes care of waiting
+        out rate limits; we just cap the number of requests in flight.
+
+        The job stops, unfinished, on anything other than a member who has
+        left: when we lack permission, every remaining request would fail
+        too, and piling up failed requests gets the bot banned by Discord.
+        """
+        channel = self.bot.get_channel(job.channel_id)
+        guild = self.bot.get_guild(job.guild_id)
+        if guild is None:
+            await self.stop_regrant(channel, job,
+                                    "I can't see this server anymore.")
+            return
+        role_id = self.verified_roles.get(job.guild_id, None)
+        if role_id is None:
+            await self.stop_regrant(
+                channel, job, f"There is no {self.role_name} role here.")
+            return
+
+        semaphore = asyncio.Semaphore(self.regrant_concurrency)
+        # Why the job had to stop, if it did.
+        problem: Optional[str] = None
+
+        async def grant(user_id: int) -> Optional[bool]:
+            """Returns whether the role was granted, or None if stopping."""
+            nonlocal problem
+            async with semaphore:
+                if problem is not None:
+                    return None
+                try:
+                    await self.bot.http.add_role(
+                        guild.id,
+                        user_id,
+                        role_id,
+                        reason="Verification Bot (re-grant)")
+                    return True
+                except discord.Forbidden:
+                    problem = (
+                        f"I don't have permission to give out {self.role_name}. "
+                        "Make sure I have Manage Roles and that my role is above it."
+                    )
+                except discord.NotFound as e:
+                    if e.code in (UNKNOWN_MEMBER, UNKNOWN_USER):
+                        return False
+                    if e.code == UNKNOWN_ROLE:
+                        problem = f"The {self.role_name} role was deleted."
+                    else:
+                        problem = f"Discord said: {e.text}."
+                except discord.HTTPException as e:
+                    self.logger.exception(
+                        f"Failed to re-grant role to {user_id} in {guild}")
+                    problem = f"Discord said: {e.text}."
+                return None
+
+        try:
+            last_report = time.monotonic()
+            while True:
+                user_ids = self.store.user_ids(job.source_guild_id,
+                                               after=job.checkpoint,
+                                               limit=REGRANT_CHUNK_SIZE)
+                if not user_ids:
+                    break
+
+                outcomes = await asyncio.gather(*map(grant, user_ids))
+                if problem is not None:
+                    # Leave the checkpoint alone so this page gets redone
+                    # once the problem is fixed.
+                    await self.stop_regrant(channel, job, problem)
+                    return
+
+                job.granted += outcomes.count(True)
+                job.skipped += outcomes.count(False)
+                job.checkpoint = user_ids[-1]
+                self.store.save_job(job)
+
+                if time.monotonic() - last_report > REGRANT_REPORT_INTERVAL_S:
+                    last_report = time.monotonic()
+                    await self.report_regrant(channel, job)
+
+            job.done = True
+            self.store.save_job(job)
+            await self.report_regrant(channel, job)
+        except Exception:
+            self.logger.exception(f"Role re-grant in {guild} failed")
+
+    async def stop_regrant(self, channel: Optional[discord.abc.Messageable],
+                           job: db.RegrantJob, problem: str):
+        """Stop a re-grant job until regrant_roles resumes it."""
+        job.stopped = True
+        self.store.save_job(job)
+        self.logger.warning(
+            f"Stopped role re-grant in {job.guild_id}: {problem}")
+        if channel is None:
+            return
+        try:
+            await channel.send(
+                f"Role re-grant stopped: {problem} "
+                "Fix that, then use regrant_roles to pick up where it left off."
+            )
+        except discord.HTTPException:
+            self.logger.exception("Failed to report stopped re-grant")
+
+    def regrant_progress(self, job: db.RegrantJob) -> str:
+        handled = job.granted + job.skipped
+        if job.done:
+            status = "Finished"
+        elif job.stopped:
+            status = "Stopped"
+        else:
+            status = "In progress"
+        return (f"{status}: {handled}/{job.total} handled. {job.granted} "
+                f"granted, {job.skipped} no longer in the server.")
+
+    async def report_regrant(self, channel: Optional[discord.abc.Messageable],
+                             job: db.RegrantJob):
+        progress = self.regrant_progress(job)
+        self.logger.info(f"Role re-grant in {job.guild_id}: {progress}")
+        if channel is None:
+            return
+        try:
+            await channel.send(f"Role re-grant: {progress}")
+        except discord.HTTPException:
+            self.logger.exception("Failed to report re-grant progress")
+
     @commands.command()
     async def verify(self, ctx):
         # Ignore all DMs for now
@@ -149,6 +349,83 @@ class VerifyCog(commands.Cog):
         self.sm.delete_session(member.id)
         await ctx.reply(f"Removed session for {member}")
 
+    @commands.command()
+    @commands.has_permissions(manage_roles=True)
+    async def regrant_roles(self, ctx, source_guild_id: Optional[int] = None):
+        """
+        Give the verified role back to everyone who has verified before,
+        without any emails. Optionally takes the id of another server to copy
+        verifications from. For users with manage roles permission only.
+        """
+        if not ctx.message.guild:
+            return
+
+        task = self.regrant_tasks.get(ctx.guild.id)
+        if task is not None and not task.done():
+            await ctx.reply(
+                "A re-grant is already running. Use regrant_status to check on it."
+            )
+            return
+
+        if source_guild_id is None:
+            source_guild_id = ctx.guild.id
+        elif not await self.can_manage_roles_in(ctx.author.id,
+                                                source_guild_id):
+            await ctx.reply(
+                "You need manage roles permission in that server too.")
+            return
+
+        # The role might have been deleted and recreated since on_ready.
+        role = discord.utils.get(ctx.guild.roles, name=self.role_name)
+        if role is None:
+            await ctx.reply(f"There is no {self.role_name} role here.")
+            return
+        self.verified_roles[ctx.guild.id] = role.id
+
+        job = self.store.job(ctx.guild.id)
+        if (job is not None and not job.done
+                and job.source_guild_id == source_guild_id):
+            # Pick up a job that was stopped, e.g. by missing permissions.
+            job.channel_id = ctx.channel.id
+            job.stopped = False
+            message = f"Resuming: {self.regrant_progress(job)}"
+        else:
+            job = db.RegrantJob(
+                guild_id=ctx.guild.id,
+                source_guild_id=source_guild_id,
+                channel_id=ctx.channel.id,
+                total=self.store.count(source_guild_id),
+            )
+            message = f"Giving {role.name} to {job.total} previously verified members."
+        self.store.save_job(job)
+        self.start_regrant(job)
+        await ctx.reply(message)
+
+    @commands.command()
+    @commands.has_permissions(manage_roles=True)
+    async def regrant_status(self, ctx):
+        """
+        Show the progress of the latest role re-grant. For users with manage
+        roles permission only.
+        """
+        if not ctx.message.guild:
+            return
+        job = self.store.job(ctx.guild.id)
+        if job is None:
+            await ctx.reply("No role re-grant has been started here.")
+            return
+        await ctx.reply(self.regrant_progress(job))
+
+    async def can_manage_roles_in(self, user_id: int, guild_id: int) -> bool:
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return False
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.HTTPException:
+            return False
+        return member.guild_permissions.manage_roles
+
 
 def main():
     logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -157,15 +434,20 @@ def main():
     expiry_seconds: int = settings.common.expiry_s
     database_file: int = settings.common.database_file
     sm = db.SessionManager(expiry_seconds, database_file)
+    store = db.VerificationStore(database_file)
 
     discordconf = settings.discord
-    bot = commands.Bot(command_prefix=discordconf.prefix)
+    intents = discord.Intents.default()
+    intents.members = discordconf.members_intent
+    bot = commands.Bot(command_prefix=discordconf.prefix, intents=intents)
     bot.add_cog(
         VerifyCog(bot=bot,
                   sm=sm,
+                  store=store,
                   check_interval=discordconf.check_interval_s,
                   url=discordconf.url,
-                  role_name=discordconf.role_name))
+                  role_name=discordconf.role_name,
+                  regrant_concurrency=discordconf.regrant_concurrency))
     bot.run(discordconf.token)
 
 
@@ -1,12 +1,19 @@
 import asyncio
+import concurrent.futures
+import contextlib
 from dataclasses import dataclass
 import datetime
 import enum
 import logging
+import os
+import queue
+import threading
+import time
 import uuid
 import sys
 import random
-from typing import AsyncIterator, Literal, Optional, Tuple, Union
+from typing import (Any, AsyncIterator, Callable, Iterable, Iterator, List,
+                    Literal, Optional, Tuple, TypeVar, Union)
 
 from sqlitedict import SqliteDict
 
@@ -15,6 +22,9 @@ from config import settings
 DEFAULT_DATABASE_FILE = settings.common.database_file
 TESTING_VERIFICATION_CODE = "-420"
 
+T = TypeVar("T")
+Op = Callable[[SqliteDict], T]
+
 
 class SessionState(enum.Enum):
     """SessionStage describes the possible states of a session.
@@ -49,21 +59,221 @@ class Session():
     remaining_attempts: int = 5
 
 
+@dataclass
+class Verification():
+    """Verification records that a user completed verification in a guild."""
+    user_id: int
+    guild_id: int
+    discord_name: str
+    timestamp: datetime.datetime
+
+
+@dataclass
+class RegrantJob():
+    """
+    RegrantJob tracks re-granting the verified role to everyone who was
+    verified in source_guild_id, in guild_id.
+
+    Users are handled in increasing user_id order, and every user_id up to
+    and including checkpoint has already been handled. A job that ran into a
+    problem it can't get past on its own is stopped until someone resumes it.
+    """
+    guild_id: int
+    source_guild_id: int
+    channel_id: int
+    total: int
+    checkpoint: int = -1
+    granted: int = 0
+    skipped: int = 0
+    done: bool = False
+    stopped: bool = False
+
+
+class GroupCommitter(object):
+    """
+    GroupCommitter applies writes from many callers in shared transactions.
+
+    Writes that arrive within window_s of the first one in a batch (up to
+    max_batch of them) are applied by a single writer thread and committed
+    together. Each write runs in its own savepoint, so one that raises is
+    rolled back without taking the rest of the batch with it. A write's
+    future only resolves after its batch has been committed.
+    """
+    __slots__ = [
+        "database_file", "window_s", "max_batch", "logger", "_queue",
+        "_thread", "_pid", "_lock"
+    ]
+
+    def __init__(self,
+                 window_s: float,
+                 max_batch: int = 256,
+                 database_file=DEFAULT_DATABASE_FILE):
+        self.database_file = database_file
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self.logger = logging.getLogger("GroupCommitter")
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # The writer thread is started lazily, and again in any child process
+        # we end up in, since threads don't survive a fork.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run,
+                                            name="GroupCommitter",
+                                            daemon=True)
+            self._thread.start()
+
+    def submit(self, op: Op) -> concurrent.futures.Future:
+        """
+        Queue op to be run against the database in the next batch.
+
+        Returns a future for op's return value.
+        """
+        self._ensure_started()
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put((op, future))
+        return future
+
+    def close(self):
+        """Flush the queued writes and stop the writer thread."""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        assert self._thread is not None
+        self._thread.join()
+        self._pid = None
+
+    def _next_batch(self) -> Optional[List[Tuple[Op, concurrent.futures.Future]]]:
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.window_s
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch first, then stop.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._commit(batch)
+            except Exception as e:
+                self.logger.exception(f"Failed to commit {len(batch)} writes")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, batch: List[Tuple[Op, concurrent.futures.Future]]):
+        outcomes = []
+        with SqliteDict(self.database_file, journal_mode="WAL") as db:
+            db.conn.execute("BEGIN IMMEDIATE")
+            for op, future in batch:
+                db.conn.execute("SAVEPOINT op")
+                try:
+                    result = op(db)
+                    # sqlitedict runs statements on its own thread and only
+                    # raises their errors on a later call, so make a round
+                    # trip to surface them while this op's savepoint is open.
+                    db.conn.select_one("SELECT 1")
+                except Exception as e:
+                    db.conn.execute("ROLLBACK TO op")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+                db.conn.execute("RELEASE op")
+            db.commit()
+
+        for future, result, exception in outcomes:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+
 class SessionManager(object):
     """
     SessionManager is a class for interacting with sessions.
 
     Sessions are keyed by discord user_id and also a uuid. There can only be
     one session per user_id.
+
+    If a GroupCommitter is given, state transitions are batched through it
+    instead of each committing on its own. wait is used to block on their
+    results, for callers that can't just block the thread (e.g. gevent).
     """
-    __slots__ = ["database_file", "expiry_seconds", "logger"]
+    __slots__ = [
+        "database_file", "expiry_seconds", "logger", "committer", "wait"
+    ]
 
-    def __init__(self,
-                 expiry_seconds: int,
-                 database_file=DEFAULT_DATABASE_FILE):
+    def __init__(
+        self,
+        expiry_seconds: int,
+        database_file=DEFAULT_DATABASE_FILE,
+        committer: Optional[GroupCommitter] = None,
+        wait: Callable[[concurrent.futures.Future],
+                       Any] = concurrent.futures.Future.result,
+    ):
         self.database_file = database_file
         self.expiry_seconds = expiry_seconds
         self.logger = logging.getLogger("SessionManager")
+        self.committer = committer
+        self.wait = wait
+
+    def _open(self, **kwargs) -> SqliteDict:
+        """
+        Open the session database.
+
+        WAL mode lets readers in other processes (web workers, the bot) carry
+        on while a write is in progress.
+        """
+        return SqliteDict(self.database_file, journal_mode="WAL", **kwargs)
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[SqliteDict]:
+        """
+        Open the session database for a read-modify-write.
+
+        The write lock is taken up front with BEGIN IMMEDIATE, so concurrent
+        writers in other processes wait their turn instead of overwriting each
+        other's changes to the same session.
+        """
+        with self._open() as db:
+            db.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.conn.execute("ROLLBACK")
+                raise
+            db.commit()
+
+    def _write(self, op: Op[T]) -> T:
+        """Run a read-modify-write op and return its result once committed."""
+        if self.committer is None:
+            with self._transaction() as db:
+                return op(db)
+        return self.wait(self.committer.submit(op))
 
     def try_new(
         self,
@@ -78,13 +288,16 @@ class SessionManager(object):
 
         Returns the secondary id (UUID) of the session, new or existing.
         """
+        return self._write(
+            self._try_new_op(user_id, guild_id, discord_name))
+
+    def _try_new_op(self, user_id: int, guild_id: int,
+                    discord_name: str) -> Op[uuid.UUID]:
         # TODO: this doesn't really work for multi-guild
         verification_code = str(random.randint(100000, 999999))
         session_uuid = uuid.uuid4()
 
-        with SqliteDict(self.database_file) as db:
-            # NOTE: there's a TOCTTOU here but there's no point fixing it
-            # since the caller will still have expiry edge cases.
+        def op(db: SqliteDict) -> uuid.UUID:
             if user_id in db:
                 return db[user_id].uuid
 
@@ -98,8 +311,9 @@ class SessionManager(object):
                 verification_code=verification_code,
                 timestamp=datetime.datetime.now(),
             )
-            db.commit()
-        return session_uuid
+            return session_uuid
+
+        return op
 
     def _new_fake(self) -> uuid.UUID:
         """Start a new fake session for testing.
@@ -108,7 +322,7 @@ class SessionManager(object):
         """
 
         session_uuid = uuid.UUID("{8ab14a16-9168-4d44-95d7-605ef23583f8}")
-        with SqliteDict(self.database_file) as db:
+        with self._transaction() as db:
             db[0] = Session(
                 uuid=session_uuid,
                 user_id=0,
@@ -117,7 +331,6 @@ class SessionManager(object):
                 verification_code=TESTING_VERIFICATION_CODE,
                 timestamp=datetime.datetime.now(),
             )
-            db.commit()
         return session_uuid
 
     def _get(self, db: SqliteDict, user_id: int,
@@ -141,14 +354,17 @@ class SessionManager(object):
 
         If the session does not exist, it returns None.
         """
-        with SqliteDict(self.database_file, flag='r') as db:
+        with self._open(flag='r') as db:
             return self._get(db, user_id, uuid)
 
     def set_email_sent(self, user_id: int, uuid: uuid.UUID):
         """
         Transitions a session into the WAITING_ON_CODE state.
         """
-        with SqliteDict(self.database_file) as db:
+        self._write(self._set_email_sent_op(user_id, uuid))
+
+    def _set_email_sent_op(self, user_id: int, uuid: uuid.UUID) -> Op[None]:
+        def op(db: SqliteDict):
             session = self._get(db, user_id, uuid)
             if session is None:
                 # This could happen if the session gets expired and deleted in
@@ -161,7 +377,8 @@ class SessionManager(object):
                 return
             session.state = SessionState.WAITING_ON_CODE
             db[user_id] = session
-            db.commit()
+
+        return op
 
     def verify(self, user_id: int, uuid: uuid.UUID,
                attempted_code: str) -> Optional[Union[int, Literal[True]]]:
@@ -173,7 +390,12 @@ class SessionManager(object):
             An integer indicating the number of attempts remaining
             None if the session doesn't exist
         """
-        with SqliteDict(self.database_file) as db:
+        return self._write(self._verify_op(user_id, uuid, attempted_code))
+
+    def _verify_op(
+        self, user_id: int, uuid: uuid.UUID, attempted_code: str
+    ) -> Op[Optional[Union[int, Literal[True]]]]:
+        def op(db: SqliteDict) -> Optional[Union[int, Literal[True]]]:
             session = self._get(db, user_id, uuid)
             if session is None:
                 return None
@@ -189,17 +411,16 @@ class SessionManager(object):
             if attempted_code == expected_code:
                 session.state = SessionState.VERIFIED
                 db[user_id] = session
-
-                db.commit()
                 return True
             else:
                 session.remaining_attempts -= 1
                 if session.remaining_attempts == 0:
                     session.state = SessionState.FAILED
                 db[user_id] = session
-                db.commit()
                 return session.remaining_attempts
 
+        return op
+
     def complete_session(self, user_id: int, uuid: uuid.UUID):
         """
         Mark a session as completed.
@@ -207,7 +428,11 @@ class SessionManager(object):
         A finished session only stays around until it expires to rate-limit
         further emails.
         """
-        with SqliteDict(self.database_file) as db:
+        self._write(self._complete_session_op(user_id, uuid))
+
+    def _complete_session_op(self, user_id: int,
+                             uuid: uuid.UUID) -> Op[None]:
+        def op(db: SqliteDict):
             session = self._get(db, user_id, uuid)
             if session is None:
                 return None
@@ -215,7 +440,8 @@ class SessionManager(object):
             assert session.state is SessionState.VERIFIED
             session.state = SessionState.COMPLETED
             db[user_id] = session
-            db.commit()
+
+        return op
 
     def delete_session(self, user_id: int):
         """
@@ -225,14 +451,18 @@ class SessionManager(object):
         debugging. Sessions that are done should have "finish_session" called
         on them.
         """
-        with SqliteDict(self.database_file) as db:
+        self._write(self._delete_session_op(user_id))
+
+    def _delete_session_op(self, user_id: int) -> Op[None]:
+        def op(db: SqliteDict):
             try:
                 del db[user_id]
-                db.commit()
             except KeyError:
                 self.logger.warn(
                     f"Attempted to delete nonexistent session for {user_id}")
 
+        return op
+
     def _expired(self, session: Session) -> bool:
         """
         Determine if a Session has expired.
@@ -246,32 +476,41 @@ class SessionManager(object):
         """
         # There's a little song and dance here so that we don't hold the
         # database open for too long.
-        with SqliteDict(self.database_file, flag='r') as db:
+        with self._open(flag='r') as db:
             session_ids = tuple(db.keys())
 
         for session_id in session_ids:
-            with SqliteDict(self.database_file, autocommit=True) as db:
-                if self._expired(db[session_id]):
-                    try:
-                        del db[session_id]
-                        db.commit()
-                    except KeyError:
-                        pass
+            with self._transaction() as db:
+                session = db.get(session_id)
+                if session is not None and self._expired(session):
+                    del db[session_id]
             await asyncio.sleep(0)
 
     async def verified_user_ids(self) -> AsyncIterator[Session]:
         """
         Yield all verified sessions.
         """
+        async for session in self._sessions_in_state(SessionState.VERIFIED):
+            yield session
+
+    async def completed_sessions(self) -> AsyncIterator[Session]:
+        """
+        Yield all completed sessions that haven't been collected yet.
+        """
+        async for session in self._sessions_in_state(SessionState.COMPLETED):
+            yield session
+
+    async def _sessions_in_state(
+            self, state: SessionState) -> AsyncIterator[Session]:
         # Another song and and dance to avoid holding the database open for too
         # long.
-        with SqliteDict(self.database_file, flag='r') as db:
+        with self._open(flag='r') as db:
             session_ids = tuple(db.keys())
 
         for session_id in session_ids:
-            with SqliteDict(self.database_file, flag='r') as db:
-                session = db[session_id]
-                if not session.state is SessionState.VERIFIED:
+            with self._open(flag='r') as db:
+                session = db.get(session_id)
+                if session is None or session.state is not state:
                     continue
 
             # HACK: For testing
@@ -279,3 +518,157 @@ class SessionManager(object):
                 continue
 
             yield session
+
+
+class AsyncSessionManager(object):
+    """
+    AsyncSessionManager exposes a SessionManager to asyncio code.
+
+    Reads run on a thread pool so they don't hold up the event loop. Writes
+    are awaited on the SessionManager's GroupCommitter directly, if it has
+    one, so concurrent tasks get committed together without tying up a pool
+    thread each; otherwise they run on the pool too.
+    """
+    __slots__ = ["sm", "executor"]
+
+    def __init__(self, sm: SessionManager, max_workers: Optional[int] = None):
+        self.sm = sm
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="AsyncSessionManager",
+        )
+
+    async def _run(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def _write(self, op: Op[T]) -> T:
+        if self.sm.committer is None:
+            return await self._run(self.sm._write, op)
+        return await asyncio.wrap_future(self.sm.committer.submit(op))
+
+    async def try_new(self, user_id: int, guild_id: int,
+                      discord_name: str) -> Optional[uuid.UUID]:
+        return await self._write(
+            self.sm._try_new_op(user_id, guild_id, discord_name))
+
+    async def session(self, user_id: int,
+                      uuid: uuid.UUID) -> Optional[Session]:
+        return await self._run(self.sm.session, user_id, uuid)
+
+    async def set_email_sent(self, user_id: int, uuid: uuid.UUID):
+        await self._write(self.sm._set_email_sent_op(user_id, uuid))
+
+    async def verify(self, user_id: int, uuid: uuid.UUID,
+                     attempted_code: str) -> Optional[Union[int, Literal[True]]]:
+        return await self._write(
+            self.sm._verify_op(user_id, uuid, attempted_code))
+
+    async def complete_session(self, user_id: int, uuid: uuid.UUID):
+        await self._write(self.sm._complete_session_op(user_id, uuid))
+
+    async def delete_session(self, user_id: int):
+        await self._write(self.sm._delete_session_op(user_id))
+
+
+def _verification_key(user_id: int) -> str:
+    # sqlitedict keys are text, so pad them to make the primary key index sort
+    # in user_id order. -1 (the initial checkpoint) sorts before everything.
+    return f"{user_id:020d}"
+
+
+class VerificationStore(object):
+    """
+    VerificationStore keeps a permanent record of completed verifications.
+
+    Unlike sessions, records never expire, so members can be given the
+    verified role again without going through email. Each guild gets its own
+    table, keyed by zero-padded user_id so it can be paged through in order.
+    Bulk re-grant jobs are also kept here so that
+    they can pick up where they left off after a restart.
+    """
+    __slots__ = ["database_file", "logger"]
+
+    def __init__(self, database_file=DEFAULT_DATABASE_FILE):
+        self.database_file = database_file
+        self.logger = logging.getLogger("VerificationStore")
+
+    def _open(self, tablename: str, **kwargs) -> SqliteDict:
+        return SqliteDict(self.database_file,
+                          tablename=tablename,
+                          journal_mode="WAL",
+                          **kwargs)
+
+    def _open_guild(self, guild_id: int) -> SqliteDict:
+        return self._open(f"verified_{guild_id}")
+
+    def record(self, user_id: int, guild_id: int, discord_name: str):
+        """Record that a user has been verified in a guild."""
+        with self._open_guild(guild_id) as db:
+            db[_verification_key(user_id)] = Verification(
+                user_id=user_id,
+                guild_id=guild_id,
+                discord_name=discord_name,
+                timestamp=datetime.datetime.now(),
+            )
+            db.commit()
+
+    def backfill(self, guild_id: int, users: Iterable[Tuple[int,
+                                                            str]]) -> int:
+        """
+        Record verifications of (user_id, discord_name) pairs that we don't
+        know about yet, all in one transaction.
+
+        Returns the number of verifications added.
+        """
+        added = 0
+        now = datetime.datetime.now()
+        with self._open_guild(guild_id) as db:
+            for user_id, discord_name in users:
+                key = _verification_key(user_id)
+                if key in db:
+                    continue
+                db[key] = Verification(
+                    user_id=user_id,
+                    guild_id=guild_id,
+                    discord_name=discord_name,
+                    timestamp=now,
+                )
+                added += 1
+            db.commit()
+        return added
+
+    def count(self, guild_id: int) -> int:
+        """Return the number of users verified in a guild."""
+        with self._open_guild(guild_id) as db:
+            return len(db)
+
+    def user_ids(self, guild_id: int, after: int, limit: int) -> List[int]:
+        """
+        Return up to limit ids of users verified in a guild that are greater
+        than after, in increasing order.
+        """
+        with self._open_guild(guild_id) as db:
+            rows = db.conn.select(
+                f'SELECT key FROM "{db.tablename}" WHERE key > ? '
+                'ORDER BY key LIMIT ?',
+                (_verification_key(after), limit),
+            )
+            return [int(key) for key, in rows]
+
+    def save_job(self, job: RegrantJob):
+        with self._open("regrant_jobs") as db:
+            db[job.guild_id] = job
+            db.commit()
+
+    def job(self, guild_id: int) -> Optional[RegrantJob]:
+        """Return the most recent re-grant job for a guild, if any."""
+        with self._open("regrant_jobs") as db:
+            return db.get(guild_id)
+
+    def unfinished_jobs(self) -> List[RegrantJob]:
+        """Return the jobs to pick back up on startup, i.e. not done or stopped."""
+        with self._open("regrant_jobs") as db:
+            return [
+                job for job in db.values() if not job.done and not job.stopped
+            ]
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import smtplib
 import ssl
@@ -51,3 +52,18 @@ class PrintMailer(object):
         msg = _generate_message(to_addr, "test@example.com", code, name)
         self.logger.info("Sending fake email")
         self.logger.info(msg)
+
+
+class AsyncMailer(object):
+    """A mailer that can be awaited, wrapping one of the blocking mailers."""
+    __slots__ = ["mail"]
+
+    def __init__(self, mail):
+        self.mail = mail
+
+    def __str__(self):
+        return f"AsyncMailer({self.mail})"
+
+    async def send(self, to_addr, code, name):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.mail.send, to_addr, code, name)
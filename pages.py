@@ -0,0 +1,62 @@
+import enum
+from typing import Literal, Optional, Union
+
+import db
+
+
+class Page(enum.Enum):
+    """Page describes the pages of the verification flow."""
+    START = enum.auto()
+    VERIFY = enum.auto()
+    SUCCESS = enum.auto()
+    FAILURE = enum.auto()
+
+
+def for_start(session: db.Session) -> Page:
+    """
+    Decide which page a session visiting /start belongs on.
+
+    Page.START means the session is waiting for an email and /start should be
+    shown; anything else is a redirect.
+    """
+    if session.state is db.SessionState.WAITING_ON_CODE:
+        return Page.VERIFY
+    if session.state in (db.SessionState.VERIFIED,
+                         db.SessionState.COMPLETED):
+        return Page.SUCCESS
+    if session.state is db.SessionState.FAILED:
+        return Page.FAILURE
+
+    assert session.state is db.SessionState.WAITING_ON_START
+    return Page.START
+
+
+def for_verify(session: db.Session) -> Page:
+    """
+    Decide which page a session visiting /verify belongs on.
+
+    Page.VERIFY means the code entry form should be shown; anything else is a
+    redirect.
+    """
+    assert session.remaining_attempts >= 0
+
+    if (session.remaining_attempts == 0
+            or session.state is db.SessionState.FAILED):
+        return Page.FAILURE
+    if session.state in (db.SessionState.VERIFIED,
+                         db.SessionState.COMPLETED):
+        return Page.SUCCESS
+    if session.state is db.SessionState.WAITING_ON_START:
+        return Page.START
+    return Page.VERIFY
+
+
+def after_verify(result: Optional[Union[int, Literal[True]]]) -> Page:
+    """Decide where to go after a SessionManager.verify attempt."""
+    if result is True:
+        return Page.SUCCESS
+    elif result == 0:
+        # TODO: give 400 error? But who cares
+        return Page.FAILURE
+    else:
+        return Page.VERIFY
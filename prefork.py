@@ -0,0 +1,226 @@
+import logging
+import os
+import select
+import signal
+import socket
+import time
+from typing import Callable, Dict, Set, Tuple
+
+# A worker that exits within this many seconds of being started is considered
+# to be crash looping, and we back off before starting another one.
+MIN_WORKER_LIFETIME_S = 1.0
+# Upper limit on how long to wait before replacing a crash looping worker.
+MAX_BACKOFF_S = 60.0
+
+
+def reuseport_listener(host: str, port: int, backlog: int = 1024):
+    """
+    Create a listening socket with SO_REUSEPORT set.
+
+    Every worker binds its own socket to the same port, and the kernel spreads
+    incoming connections across them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class Supervisor(object):
+    """
+    Supervisor forks and babysits a fixed number of worker processes.
+
+    Workers that die are replaced, backing off exponentially if they keep
+    dying right after starting. SIGTERM/SIGINT stops all of them: workers are
+    sent SIGTERM and are expected to finish their in-flight requests and exit.
+
+    SIGHUP replaces the workers one at a time, only retiring an old worker
+    once its replacement has called ready(). The workers are forked from
+    this process, so new code is only picked up by a full restart; anything
+    the worker function loads for itself (e.g. settings) is reloaded.
+    """
+    __slots__ = [
+        "worker", "num_workers", "graceful_timeout", "workers", "retiring",
+        "logger", "_running", "_restart_requested", "_pending", "_failures",
+        "_next_spawn"
+    ]
+
+    def __init__(self,
+                 worker: Callable[[Callable[[], None]], None],
+                 num_workers: int,
+                 graceful_timeout: float = 30):
+        self.worker = worker
+        self.num_workers = num_workers
+        self.graceful_timeout = graceful_timeout
+        # pid -> start time
+        self.workers: Dict[int, float] = {}
+        # Old workers that have been told to exit during a restart.
+        self.retiring: Set[int] = set()
+        self.logger = logging.getLogger("Supervisor")
+        self._running = False
+        self._restart_requested = False
+        # Number of workers that died and still need replacing.
+        self._pending = 0
+        # Number of workers in a row that died right after starting.
+        self._failures = 0
+        self._next_spawn = 0.0
+
+    def _spawn(self) -> Tuple[int, int]:
+        """
+        Fork a worker.
+
+        Returns the worker's pid and the read end of a pipe that becomes
+        readable once the worker is ready (or has died). The caller owns it.
+        """
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            # Child: undo the supervisor's signal handlers and become a worker.
+            # Ctrl-C reaches the whole process group, so leave it to the
+            # supervisor to shut us down gracefully.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            def ready():
+                try:
+                    os.write(ready_w, b"!")
+                except BrokenPipeError:
+                    # Nobody is waiting for this worker to be ready.
+                    pass
+
+            status = 0
+            try:
+                self.worker(ready)
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    status = e.code
+                elif e.code is not None:
+                    status = 1
+            except Exception:
+                self.logger.exception(f"Worker {os.getpid()} crashed")
+                status = 1
+            finally:
+                logging.shutdown()
+                os._exit(status)
+
+        os.close(ready_w)
+        self.workers[pid] = time.monotonic()
+        self.logger.info(f"Started worker {pid}")
+        return pid, ready_r
+
+    def _spawn_pending(self):
+        """Replace dead workers, unless we're backing off."""
+        while self._pending and time.monotonic() >= self._next_spawn:
+            self._pending -= 1
+            _, ready_r = self._spawn()
+            os.close(ready_r)
+
+    def _reap(self):
+        """Collect exited workers and schedule replacements for unexpected exits."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            started = self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                self.logger.info(f"Retired worker {pid}")
+                continue
+            if started is None or not self._running:
+                continue
+
+            self.logger.warning(
+                f"Worker {pid} exited unexpectedly with status {status}")
+            self._pending += 1
+            if time.monotonic() - started < MIN_WORKER_LIFETIME_S:
+                self._failures += 1
+                backoff = min(MAX_BACKOFF_S,
+                              MIN_WORKER_LIFETIME_S * 2**(self._failures - 1))
+                self.logger.warning(
+                    f"Worker is crash looping, waiting {backoff}s to replace it"
+                )
+                self._next_spawn = time.monotonic() + backoff
+            else:
+                self._failures = 0
+
+    def _wait_ready(self, ready_r: int) -> bool:
+        """Wait for a new worker to report that it is ready."""
+        try:
+            readable, _, _ = select.select([ready_r], [], [],
+                                           self.graceful_timeout)
+            return bool(readable) and os.read(ready_r, 1) == b"!"
+        finally:
+            os.close(ready_r)
+
+    def _restart(self):
+        """Replace each worker with a fresh one, one at a time."""
+        self.logger.info("Restarting workers")
+        # Workers still draining from an earlier restart are already on their
+        # way out and have been replaced.
+        for pid in [pid for pid in self.workers if pid not in self.retiring]:
+            new_pid, ready_r = self._spawn()
+            if not self._wait_ready(ready_r):
+                self.logger.error(
+                    f"Worker {new_pid} never became ready, aborting restart")
+                self.retiring.add(new_pid)
+                self._kill(new_pid, signal.SIGTERM)
+                return
+            self.retiring.add(pid)
+            self._kill(pid, signal.SIGTERM)
+
+    def _kill(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _stop_all(self):
+        pids = set(self.workers) | self.retiring
+        self.retiring |= pids
+        for pid in pids:
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        for pid in list(self.workers):
+            self.logger.warning(f"Killing worker {pid}")
+            self._kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            del self.workers[pid]
+
+    def _handle_stop(self, signum, frame):
+        self._running = False
+
+    def _handle_restart(self, signum, frame):
+        self._restart_requested = True
+
+    def run(self):
+        """Start the workers and supervise them until told to stop."""
+        self._running = True
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        self._pending = self.num_workers
+        while self._running:
+            if self._restart_requested:
+                self._restart_requested = False
+                self._restart()
+            self._reap()
+            self._spawn_pending()
+            time.sleep(0.5)
+
+        self.logger.info("Stopping workers")
+        self._stop_all()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import logging
+import sys
+from typing import Optional, Union
+
+from aiohttp import web
+
+from config import settings
+import async_server
+import db
+import mailer
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    logging.getLogger("sqlitedict").setLevel(logging.WARNING)
+
+    smtp_host: str = settings.server.smtp_host
+    smtp_port: int = settings.server.smtp_port
+    smtp_user: str = settings.server.smtp_user
+    smtp_pass: str = settings.server.smtp_pass
+    smtp_from_addr: str = settings.server.smtp_from_addr
+    allowed_domain: str = settings.server.allowed_domain
+
+    mail: Union[mailer.SMTPMailer, mailer.PrintMailer]
+    if not smtp_host:
+        mail = mailer.PrintMailer()
+    else:
+        mail = mailer.SMTPMailer(
+            host=smtp_host,
+            port=smtp_port,
+            username=smtp_user,
+            password=smtp_pass,
+            from_addr=smtp_from_addr,
+        )
+
+    expiry_seconds: int = settings.common.expiry_s
+    database_file: int = settings.common.database_file
+    group_commit_window_ms: int = settings.server.group_commit_window_ms
+    committer: Optional[db.GroupCommitter] = None
+    if group_commit_window_ms > 0:
+        committer = db.GroupCommitter(
+            window_s=group_commit_window_ms / 1000,
+            database_file=database_file,
+        )
+    sm = db.SessionManager(expiry_seconds, database_file, committer=committer)
+
+    app = async_server.create_app(
+        session_manager=db.AsyncSessionManager(sm),
+        mail=mailer.AsyncMailer(mail),
+        allowed_domain=allowed_domain,
+    )
+    web.run_app(app, port=settings.server.port)
@@ -1,19 +1,44 @@
 #!/usr/bin/env python3
+import concurrent.futures
 import logging
+import signal
 import sys
-from typing import Union
+from typing import Optional, Union
 
+import gevent
+import gevent.pool
+from gevent.hub import Waiter
 from gevent.pywsgi import WSGIServer
 
 from config import settings
 import db
 import mailer
+import prefork
 import server
 
-if __name__ == "__main__":
-    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
-    logging.getLogger("sqlitedict").setLevel(logging.WARNING)
 
+def gevent_wait(future: concurrent.futures.Future):
+    """
+    Wait on a future from another thread without blocking the hub.
+
+    The future's callback pokes an async watcher, which is safe to do from any
+    thread, and the watcher wakes this greenlet back up in the hub. Nothing is
+    tied up while waiting, so any number of greenlets can wait on one batch.
+    """
+    hub = gevent.get_hub()
+    waiter = Waiter(hub)
+    watcher = hub.loop.async_()
+    watcher.start(waiter.switch, None)
+    try:
+        future.add_done_callback(lambda _: watcher.send())
+        waiter.get()
+    finally:
+        watcher.close()
+    return future.result()
+
+
+def build_app():
+    """Build the web app from the current settings."""
     smtp_host: str = settings.server.smtp_host
     smtp_port: int = settings.server.smtp_port
     smtp_user: str = settings.server.smtp_user
@@ -35,12 +60,63 @@ if __name__ == "__main__":
 
     expiry_seconds: int = settings.common.expiry_s
     database_file: int = settings.common.database_file
-    sm = db.SessionManager(expiry_seconds, database_file)
+    group_commit_window_ms: int = settings.server.group_commit_window_ms
+    committer: Optional[db.GroupCommitter] = None
+    if group_commit_window_ms > 0:
+        committer = db.GroupCommitter(
+            window_s=group_commit_window_ms / 1000,
+            database_file=database_file,
+        )
+    sm = db.SessionManager(expiry_seconds,
+                           database_file,
+                           committer=committer,
+                           wait=gevent_wait)
 
-    app = server.create_app(
+    return server.create_app(
         session_manager=sm,
         mail=mail,
         allowed_domain=allowed_domain,
     )
-    http_server = WSGIServer(('', 5000), app)
-    http_server.serve_forever()
+
+
+def serve_worker(port: int, graceful_timeout: float, ready):
+    """Serve the app on a SO_REUSEPORT socket until SIGTERM."""
+    # Pick up any settings changes since the supervisor started, so that a
+    # graceful restart (SIGHUP) applies them.
+    settings.reload()
+    serve(build_app(), prefork.reuseport_listener('', port), graceful_timeout,
+          ready)
+
+
+def serve(app, listener, graceful_timeout: float, ready):
+    """
+    Serve app on listener until SIGTERM, then let in-flight requests finish.
+
+    The requests have to run in a pool for the server to be able to wait for
+    them; without one, stopping just returns and the worker exits under them.
+    """
+    http_server = WSGIServer(listener, app, spawn=gevent.pool.Pool())
+    # Stop accepting new connections; serve_forever then waits for the pool.
+    gevent.signal_handler(signal.SIGTERM, http_server.close)
+    http_server.start()
+    ready()
+    http_server.serve_forever(stop_timeout=graceful_timeout)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    logging.getLogger("sqlitedict").setLevel(logging.WARNING)
+
+    port: int = settings.server.port
+    workers: int = settings.server.workers
+    graceful_timeout: float = settings.server.graceful_timeout_s
+    if workers <= 1:
+        http_server = WSGIServer(('', port), build_app())
+        http_server.serve_forever()
+    else:
+        supervisor = prefork.Supervisor(
+            worker=lambda ready: serve_worker(port, graceful_timeout, ready),
+            num_workers=workers,
+            graceful_timeout=graceful_timeout,
+        )
+        supervisor.run()
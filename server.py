@@ -14,6 +14,7 @@ from werkzeug.routing import BaseConverter, ValidationError
 import db
 from config import settings
 import mailer
+import pages
 
 
 def redirect_to_verify(user_id: int, secondary_id: uuid.UUID):
@@ -24,6 +25,20 @@ def redirect_to_verify(user_id: int, secondary_id: uuid.UUID):
                     code=303)
 
 
+def redirect_to_page(page: pages.Page, user_id: int, secondary_id: uuid.UUID):
+    """Return a 303 redirect to a page of the verification flow."""
+    if page is pages.Page.START:
+        return redirect(url_for("start",
+                                user_id=user_id,
+                                secondary_id=secondary_id),
+                        code=303)
+    if page is pages.Page.VERIFY:
+        return redirect_to_verify(user_id, secondary_id)
+    if page is pages.Page.SUCCESS:
+        return redirect(url_for("success"), code=303)
+    return redirect(url_for("failure"), code=303)
+
+
 def set_cache(response):
     response.cache_control.public = True
     response.cache_control.max_age = 2592000
@@ -50,15 +65,9 @@ def create_app(
             abort(404)
 
         # Handle other states that shouldn't go to /start.
-        if session.state is db.SessionState.WAITING_ON_CODE:
-            return redirect_to_verify(user_id, secondary_id)
-        if session.state in (db.SessionState.VERIFIED,
-                             db.SessionState.COMPLETED):
-            return redirect(url_for("success"), code=303)
-        if session.state is db.SessionState.FAILED:
-            return redirect(url_for("failure"), code=303)
-
-        assert session.state is db.SessionState.WAITING_ON_START
+        page = pages.for_start(session)
+        if page is not pages.Page.START:
+            return redirect_to_page(page, user_id, secondary_id)
 
         if request.method == "POST":
             email_addr = request.form["email"]
@@ -84,14 +93,8 @@ def create_app(
         # Post-Redirect-Get pattern
         attempted_code: str = request.form["verification"]
         verification_result = sm.verify(user_id, secondary_id, attempted_code)
-
-        if verification_result is True:
-            return redirect(url_for("success"), code=303)
-        elif verification_result == 0:
-            # TODO: give 400 error? But who cares
-            return redirect(url_for("failure"), code=303)
-        else:
-            return redirect_to_verify(user_id, secondary_id)
+        return redirect_to_page(pages.after_verify(verification_result),
+                                user_id, secondary_id)
 
     @app.route("/verify/<int:user_id>/<uuid:secondary_id>", methods=["GET"])
     def verify_get(user_id: int, secondary_id: uuid.UUID):
@@ -103,18 +106,10 @@ def create_app(
         if remaining_attempts is None:
             abort(404)
 
-        assert remaining_attempts >= 0
-
         # Handle other states that shouldn't go to /verify
-        if remaining_attempts == 0 or session.state == db.SessionState.FAILED:
-            return redirect(url_for("failure"), code=303)
-        if session.state == db.SessionState.VERIFIED:
-            return redirect(url_for("success"), code=303)
-        if session.state == db.SessionState.WAITING_ON_START:
-            return redirect(url_for("start",
-                                    user_id=user_id,
-                                    secondary_id=secondary_id),
-                            code=303)
+        page = pages.for_verify(session)
+        if page is not pages.Page.VERIFY:
+            return redirect_to_page(page, user_id, secondary_id)
 
         return render_template(
             "verify.html",
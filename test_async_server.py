@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import async_server
+import db
+
+
+class AsyncServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.sm = db.SessionManager(1000,
+                                    os.path.join(tmp.name, "test.sqlite"))
+        async_sm = db.AsyncSessionManager(self.sm)
+        self.addCleanup(async_sm.executor.shutdown)
+        app = async_server.create_app(async_sm, "@uwaterloo.ca")
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+        self.secondary_id = self.sm.try_new(1, 9, "user#1")
+
+    async def test_missing_form_field_is_bad_request(self):
+        for page in ("start", "verify"):
+            with self.subTest(page=page):
+                response = await self.client.post(
+                    f"/{page}/1/{self.secondary_id}", data={})
+                self.assertEqual(response.status, 400)
+
+    async def test_bad_uuid_is_not_found(self):
+        for page in ("start", "verify"):
+            with self.subTest(page=page):
+                response = await self.client.get(f"/{page}/1/not-a-uuid")
+                self.assertEqual(response.status, 404)
+
+    async def test_completed_session_redirects_to_success(self):
+        code = self.sm.session(1, self.secondary_id).verification_code
+        assert self.sm.verify(1, self.secondary_id, code)
+        self.sm.complete_session(1, self.secondary_id)
+
+        for page in ("start", "verify"):
+            with self.subTest(page=page):
+                response = await self.client.get(
+                    f"/{page}/1/{self.secondary_id}", allow_redirects=False)
+                self.assertEqual(response.status, 303)
+                self.assertEqual(response.headers["Location"], "/success")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List
+
+import discord
+
+import bot
+import db
+
+GUILD_ID = 9
+ROLE_ID = 99
+
+
+def http_error(cls, code: int):
+    response = SimpleNamespace(status=403 if cls is discord.Forbidden else 404,
+                               reason="")
+    return cls(response, {"code": code, "message": "error"})
+
+
+class FakeHTTP:
+    def __init__(self, errors: Dict[int, Exception]):
+        self.errors = errors
+        self.granted: List[int] = []
+
+    async def add_role(self, guild_id, user_id, role_id, reason=None):
+        assert (guild_id, role_id) == (GUILD_ID, ROLE_ID)
+        if user_id in self.errors:
+            raise self.errors[user_id]
+        self.granted.append(user_id)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages: List[str] = []
+
+    async def send(self, message: str):
+        self.messages.append(message)
+
+
+class FakeBot:
+    def __init__(self, errors: Dict[int, Exception]):
+        self.http = FakeHTTP(errors)
+        self.channel = FakeChannel()
+        self.guild = SimpleNamespace(id=GUILD_ID, name="guild")
+        self.loop = SimpleNamespace(create_task=lambda coro: coro.close())
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == GUILD_ID else None
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+
+class RegrantLoopTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        database_file = os.path.join(tmp.name, "test.sqlite")
+        self.store = db.VerificationStore(database_file)
+        for user_id in (1, 2, 3):
+            self.store.record(user_id, GUILD_ID, f"user#{user_id}")
+
+    def cog(self, errors: Dict[int, Exception]) -> bot.VerifyCog:
+        cog = bot.VerifyCog(FakeBot(errors),
+                            sm=None,
+                            store=self.store,
+                            check_interval=60,
+                            url="",
+                            role_name="Verified",
+                            regrant_concurrency=2)
+        cog.verified_roles = {GUILD_ID: ROLE_ID}
+        return cog
+
+    def job(self) -> db.RegrantJob:
+        job = db.RegrantJob(guild_id=GUILD_ID,
+                            source_guild_id=GUILD_ID,
+                            channel_id=1,
+                            total=self.store.count(GUILD_ID))
+        self.store.save_job(job)
+        return job
+
+    async def test_skips_members_who_left(self):
+        cog = self.cog({2: http_error(discord.NotFound, bot.UNKNOWN_MEMBER)})
+
+        await cog.regrant_loop(self.job())
+
+        job = self.store.job(GUILD_ID)
+        self.assertTrue(job.done)
+        self.assertEqual((job.granted, job.skipped), (2, 1))
+        self.assertEqual(sorted(cog.bot.http.granted), [1, 3])
+
+    async def test_stops_when_forbidden(self):
+        cog = self.cog({2: http_error(discord.Forbidden, 50013)})
+
+        await cog.regrant_loop(self.job())
+
+        self.assert_stopped(cog, "permission")
+
+    async def test_stops_when_role_is_deleted(self):
+        cog = self.cog({1: http_error(discord.NotFound, bot.UNKNOWN_ROLE)})
+
+        await cog.regrant_loop(self.job())
+
+        self.assert_stopped(cog, "deleted")
+
+    async def test_stops_when_role_is_missing(self):
+        cog = self.cog({})
+        cog.verified_roles = {}
+
+        await cog.regrant_loop(self.job())
+
+        self.assert_stopped(cog, "no Verified role")
+        self.assertEqual(cog.bot.http.granted, [])
+
+    def assert_stopped(self, cog: bot.VerifyCog, reason: str):
+        job = self.store.job(GUILD_ID)
+        self.assertTrue(job.stopped)
+        self.assertFalse(job.done)
+        # The page gets redone once resumed.
+        self.assertEqual(job.checkpoint, -1)
+        self.assertEqual(self.store.unfinished_jobs(), [])
+        [message] = cog.bot.channel.messages
+        self.assertIn(reason, message)
+        self.assertIn("Stopped", cog.regrant_progress(job))
+
+
+if __name__ == "__main__":
+    unittest.main()
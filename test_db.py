@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from sqlitedict import SqliteDict
+
+import db
+
+
+class GroupCommitterTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.database_file = os.path.join(tmp.name, "test.sqlite")
+        self.committer = db.GroupCommitter(window_s=0.05,
+                                           database_file=self.database_file)
+        self.addCleanup(self.committer.close)
+
+    def test_failing_write_only_fails_its_own_caller(self):
+        def bad(d: SqliteDict):
+            d.conn.execute("INSERT INTO missing VALUES (1)")
+
+        def good(d: SqliteDict):
+            d[1] = "good"
+            return "ok"
+
+        def after(d: SqliteDict):
+            d[2] = "after"
+            return "ok"
+
+        # Submitted back to back, so they all land in the same batch.
+        futures = [self.committer.submit(op) for op in (good, bad, after)]
+
+        self.assertEqual(futures[0].result(timeout=5), "ok")
+        with self.assertRaisesRegex(Exception, "no such table"):
+            futures[1].result(timeout=5)
+        self.assertEqual(futures[2].result(timeout=5), "ok")
+        with SqliteDict(self.database_file) as d:
+            self.assertEqual(d[1], "good")
+            self.assertEqual(d[2], "after")
+
+    def test_failing_write_is_rolled_back(self):
+        def partial(d: SqliteDict):
+            d[1] = "partial"
+            d.conn.execute("INSERT INTO missing VALUES (1)")
+
+        with self.assertRaises(Exception):
+            self.committer.submit(partial).result(timeout=5)
+        with SqliteDict(self.database_file) as d:
+            self.assertNotIn(1, d)
+
+
+class CountingCommitter(db.GroupCommitter):
+    __slots__ = ["batch_sizes"]
+
+    def _commit(self, batch):
+        self.batch_sizes.append(len(batch))
+        super()._commit(batch)
+
+
+class AsyncSessionManagerTest(unittest.TestCase):
+    def test_writes_batch_beyond_pool_size(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        database_file = os.path.join(tmp.name, "test.sqlite")
+        committer = CountingCommitter(window_s=0.05,
+                                      database_file=database_file)
+        committer.batch_sizes = []
+        self.addCleanup(committer.close)
+        sm = db.AsyncSessionManager(db.SessionManager(
+            1000, database_file, committer=committer),
+                                    max_workers=2)
+        self.addCleanup(sm.executor.shutdown)
+
+        async def start_sessions():
+            return await asyncio.gather(
+                *(sm.try_new(user_id, 9, f"user#{user_id}")
+                  for user_id in range(50)))
+
+        self.assertEqual(len(set(asyncio.run(start_sessions()))), 50)
+        self.assertEqual(committer.batch_sizes, [50])
+
+
+class VerificationStoreTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.database_file = os.path.join(tmp.name, "test.sqlite")
+        self.store = db.VerificationStore(self.database_file)
+
+    def test_pages_in_user_id_order(self):
+        for user_id in (30, 5, 200, 17, 1000):
+            self.store.record(user_id, 9, "name#1")
+
+        self.assertEqual(self.store.count(9), 5)
+        self.assertEqual(self.store.user_ids(9, after=-1, limit=2), [5, 17])
+        self.assertEqual(self.store.user_ids(9, after=17, limit=2), [30, 200])
+        self.assertEqual(self.store.user_ids(9, after=200, limit=2), [1000])
+        self.assertEqual(self.store.user_ids(9, after=1000, limit=2), [])
+        self.assertEqual(self.store.user_ids(8, after=-1, limit=2), [])
+
+    def test_backfill_skips_known_users(self):
+        self.store.record(1, 9, "old#1")
+
+        added = self.store.backfill(9, [(1, "new#1"), (2, "new#2")])
+
+        self.assertEqual(added, 1)
+        self.assertEqual(self.store.user_ids(9, after=-1, limit=10), [1, 2])
+
+    def test_unfinished_jobs_skip_done_and_stopped(self):
+        self.store.save_job(db.RegrantJob(1, 1, 0, total=0))
+        self.store.save_job(db.RegrantJob(2, 2, 0, total=0, done=True))
+        self.store.save_job(db.RegrantJob(3, 3, 0, total=0, stopped=True))
+
+        self.assertEqual([job.guild_id for job in self.store.unfinished_jobs()],
+                         [1])
+
+    def test_completed_sessions(self):
+        sm = db.SessionManager(1000, self.database_file)
+        done = sm.try_new(1, 9, "done#1")
+        sm.try_new(2, 9, "waiting#2")
+        assert sm.verify(1, done, sm.session(1, done).verification_code)
+        sm.complete_session(1, done)
+
+        async def collect():
+            return [s.user_id async for s in sm.completed_sessions()]
+
+        self.assertEqual(asyncio.run(collect()), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import datetime
+import unittest
+import uuid
+
+import db
+import pages
+from pages import Page
+
+
+def session(state: db.SessionState, remaining_attempts: int = 5):
+    return db.Session(
+        uuid=uuid.uuid4(),
+        user_id=1,
+        guild_id=9,
+        discord_name="user#1",
+        verification_code="123456",
+        timestamp=datetime.datetime.now(),
+        state=state,
+        remaining_attempts=remaining_attempts,
+    )
+
+
+class PagesTest(unittest.TestCase):
+    def test_for_start(self):
+        expected = {
+            db.SessionState.WAITING_ON_START: Page.START,
+            db.SessionState.WAITING_ON_CODE: Page.VERIFY,
+            db.SessionState.VERIFIED: Page.SUCCESS,
+            db.SessionState.COMPLETED: Page.SUCCESS,
+            db.SessionState.FAILED: Page.FAILURE,
+        }
+        for state, page in expected.items():
+            with self.subTest(state=state):
+                self.assertIs(pages.for_start(session(state)), page)
+
+    def test_for_verify(self):
+        expected = {
+            db.SessionState.WAITING_ON_START: Page.START,
+            db.SessionState.WAITING_ON_CODE: Page.VERIFY,
+            db.SessionState.VERIFIED: Page.SUCCESS,
+            db.SessionState.COMPLETED: Page.SUCCESS,
+            db.SessionState.FAILED: Page.FAILURE,
+        }
+        for state, page in expected.items():
+            with self.subTest(state=state):
+                self.assertIs(pages.for_verify(session(state)), page)
+
+    def test_for_verify_out_of_attempts(self):
+        self.assertIs(
+            pages.for_verify(
+                session(db.SessionState.WAITING_ON_CODE,
+                        remaining_attempts=0)), Page.FAILURE)
+
+    def test_after_verify(self):
+        self.assertIs(pages.after_verify(True), Page.SUCCESS)
+        self.assertIs(pages.after_verify(0), Page.FAILURE)
+        self.assertIs(pages.after_verify(3), Page.VERIFY)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import signal
+import time
+import unittest
+
+import prefork
+
+
+def idle_worker(ready):
+    ready()
+    time.sleep(60)
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = prefork.Supervisor(idle_worker,
+                                             num_workers=2,
+                                             graceful_timeout=5)
+        self.addCleanup(self.kill_all)
+
+    def kill_all(self):
+        for pid in list(self.supervisor.workers):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+    def test_restart_skips_retiring_workers(self):
+        # A second SIGHUP arriving while a worker from the first restart is
+        # still draining: two live workers plus the one on its way out.
+        for _ in range(3):
+            _, ready_r = self.supervisor._spawn()
+            os.close(ready_r)
+        old = set(self.supervisor.workers)
+        self.supervisor.retiring.add(next(iter(old)))
+
+        self.supervisor._restart()
+
+        self.assertEqual(len(self.supervisor.workers), 5)
+        self.assertTrue(old <= self.supervisor.retiring)
+        live = set(self.supervisor.workers) - self.supervisor.retiring
+        self.assertEqual(len(live), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import http.client
+import os
+import signal
+import time
+import unittest
+
+import gevent
+
+import prefork
+import run_web
+
+
+class ServeTest(unittest.TestCase):
+    def test_sigterm_waits_for_in_flight_requests(self):
+        def slow_app(environ, start_response):
+            gevent.sleep(1)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"done"]
+
+        listener = prefork.reuseport_listener("127.0.0.1", 0)
+        port = listener.getsockname()[1]
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_web.serve(slow_app, listener, 10,
+                              lambda: os.write(ready_w, b"!"))
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        listener.close()
+        os.close(ready_w)
+        self.assertEqual(os.read(ready_r, 1), b"!")
+        os.close(ready_r)
+
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", "/")
+        time.sleep(0.3)
+        os.kill(pid, signal.SIGTERM)
+
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.read(), b"done")
+        conn.close()
+        # Exits once the request is done, well before the stop timeout.
+        started = time.monotonic()
+        _, status = os.waitpid(pid, 0)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()